@@ -1,16 +1,118 @@
 import os
+import sys
 import json
-import copy
-from openai import OpenAI
+import asyncio
+import shelve
+import hashlib
+import httpx
+import openai
+from openai import AsyncOpenAI
+from agent.ratelimit import RateLimiter, with_retries
+
+def _lower_types(schema):
+    """Returns a copy of a Gemini schema with OpenAI (lowercase) type names; leaf values are shared."""
+    if isinstance(schema, dict):
+        return {
+            k: v.lower() if k == "type" and isinstance(v, str) else _lower_types(v)
+            for k, v in schema.items()
+        }
+    elif isinstance(schema, list):
+        return [_lower_types(i) for i in schema]
+    return schema
+
+# Static head first: providers cache prompts by literal prefix, so nothing per-batch may precede the tools
+BATCH_PROMPT_HEADER = """You will receive independent requests, each between <<PROMPT i>> and <<END i>> markers.
+For each request, choose exactly one of the tools below and fill in its arguments.
+Tools (JSON schema):
+{tools}
+
+Return only a JSON object of the form {{"calls": [{{"name": "<tool name>", "args": {{...}}}}, ...]}}
+with one entry per request, in the same order as the requests.
+
+"""
+
+BATCH_PROMPT_REQUESTS = """There are {n} requests.
+
+{prompts}"""
+
+SUMMARY_PROMPT = """Summarize the conversation below between a user and a Blender material agent.
+Keep material names, file paths, user preferences and unfinished requests; leave out tool output details.
+Reply with the summary only."""
+
+# Once a request's context exceeds this many tokens, older turns are folded into a summary
+MAX_CONTEXT_TOKENS = int(os.getenv("LLM_MAX_CONTEXT_TOKENS", "8000"))
+# Most recent user turns always kept verbatim
+KEEP_TURNS = int(os.getenv("LLM_KEEP_TURNS", "4"))
+# Client-side throttling; 0 disables a limit
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))
+# Opt-in replay of tool-free replies for an identical model, tool set, history and message
+LLM_CACHE = os.getenv("LLM_CACHE") == "1"
+LLM_CACHE_PATH = os.path.join("output", ".llm_cache.db")
+
+# Tool arguments/results are cut to this many characters in summary transcripts
+TOOL_PAYLOAD_CHARS = 200
+
+# One connection pool shared by every AsyncOpenAI client in the process
+_HTTP_CLIENT = None
+
+def shared_http_client():
+    """Returns the process-wide keep-alive pool, using HTTP/2 when the optional h2 package is installed."""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        try:
+            import h2 # noqa: F401
+            http2 = True
+        except ImportError:
+            http2 = False
+        _HTTP_CLIENT = openai.DefaultAsyncHttpxClient(
+            http2=http2,
+            timeout=httpx.Timeout(60, connect=5),
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+        )
+    return _HTTP_CLIENT
+
+async def close_http_client():
+    """Closes the shared pool; call before the event loop that used it shuts down."""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
+
+def _clip(text, limit=TOOL_PAYLOAD_CHARS):
+    text = str(text)
+    return text if len(text) <= limit else text[:limit] + "..."
 
 class LLMClient:
-    def __init__(self, provider="gemini", tools=None, history=None):
+    # Most prompts packed into one batched request; returns diminish beyond this
+    BATCH_LIMIT = 8
+    # Content hash of a Gemini tool schema -> OpenAI tool envelope, shared by all sessions
+    _SCHEMA_CACHE = {}
+
+    def __init__(self, provider="gemini", tools=None, history=None, max_concurrent=4, openai_tools=None,
+                 tools_json=None, tools_hash=None):
         self.provider = provider.lower()
         self.tools = tools or []
+        # Serialized tools (bytes), embedded in batch prompts; callers may pass a copy made once at import
+        self.tools_json = tools_json if tools_json is not None else json.dumps(self.tools).encode()
+        self.tools_hash = tools_hash or hashlib.blake2b(self.tools_json, digest_size=8).hexdigest()
+        self.batch_header = BATCH_PROMPT_HEADER.format(tools=self.tools_json.decode("utf-8"))
         self.history = history or [] # [{"role": "user", "content": ...}] for OpenAI
         self.chat_session = None
+        self.plain_model = None # Tool-less Gemini model for batch and summary requests
         self.genai = None # Handle for the module
-        
+        self.compaction = None # Background summarization task, applied before the next request
+        # Leading system messages are never summarized away
+        self.pinned = 0
+        while self.pinned < len(self.history) and self.history[self.pinned].get("role") == "system":
+            self.pinned += 1
+        # Caps the number of in-flight API requests (openai-cookbook parallel processor pattern)
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.limiter = RateLimiter(rpm=LLM_RPM, tpm=LLM_TPM)
+        self.context_tokens = 0 # Size of the last request; estimates the next one for the limiter
+        if LLM_CACHE:
+            os.makedirs(os.path.dirname(LLM_CACHE_PATH), exist_ok=True)
+
         if self.provider == "gemini":
             import google.generativeai as genai
             self.genai = genai
@@ -18,192 +120,401 @@ class LLMClient:
             self.model_name = os.getenv("GEMINI_MODEL", "gemini")
             if not api_key:
                 raise ValueError("GEMINI_API_KEY not found")
-            
+
             self.genai.configure(api_key=api_key)
             self.model = self.genai.GenerativeModel(self.model_name, tools=self.tools)
             self.chat_session = self.model.start_chat(enable_automatic_function_calling=False)
-            
+
+            from google.api_core import exceptions as google_exceptions
+            self.retry_on = (
+                google_exceptions.ResourceExhausted,
+                google_exceptions.ServiceUnavailable,
+                google_exceptions.DeadlineExceeded,
+                google_exceptions.InternalServerError
+            )
+
         elif self.provider == "openai":
             api_key = os.getenv("OPENAI_API_KEY")
             self.model_name = os.getenv("OPENAI_MODEL", "gpt")
             if not api_key:
                 raise ValueError("OPENAI_API_KEY not found")
-            
-            self.client = OpenAI(api_key=api_key)
-            # OpenAI doesn't have a stateful "chat session" object like Gemini, 
+
+            # Retries are handled by with_retries so they respect the shared rate limiter
+            self.client = AsyncOpenAI(api_key=api_key, max_retries=0, http_client=shared_http_client())
+            self.retry_on = (
+                openai.RateLimitError,
+                openai.APIConnectionError, # Includes APITimeoutError
+                openai.InternalServerError
+            )
+            # OpenAI doesn't have a stateful "chat session" object like Gemini,
             # so we manage self.history manually.
-            
-            # Convert Gemini-style tools to OpenAI format
-            self.openai_tools = []
-            for t in self.tools:
-                # We need to sanitize the function definition
-                openai_func = self._sanitize_schema(t)
-                self.openai_tools.append({
-                    "type": "function",
-                    "function": openai_func
-                })
-                
+
+            # Convert Gemini-style tools to OpenAI format, unless the caller pre-shaped them
+            if openai_tools is not None:
+                self.openai_tools = openai_tools
+            else:
+                self.openai_tools = [self.to_openai_tool(t) for t in self.tools]
+
         else:
             raise ValueError(f"Unknown provider: {provider}")
 
-    def _sanitize_schema(self, schema):
-        """Helper to convert Gemini schema (uppercase types) to OpenAI (lowercase)"""
-        new_schema = copy.deepcopy(schema)
-        
-        def recurse(d):
-            if isinstance(d, dict):
-                if "type" in d and isinstance(d["type"], str):
-                    d["type"] = d["type"].lower()
-                for v in d.values():
-                    recurse(v)
-            elif isinstance(d, list):
-                for i in d:
-                    recurse(i)
-        
-        recurse(new_schema)
-        return new_schema
-
-    def send_message(self, message):
+    async def _call(self, make_call):
+        """Awaits one API request under the rate limiter, retrying transient provider errors."""
+        return await with_retries(make_call, self.limiter, self.retry_on, est_tokens=self.context_tokens)
+
+    def _plain_model(self):
+        if self.plain_model is None:
+            self.plain_model = self.genai.GenerativeModel(self.model_name)
+        return self.plain_model
+
+    @classmethod
+    def to_openai_tool(cls, schema):
+        """Helper to convert a Gemini tool schema (uppercase types) to an OpenAI tool, memoized by content"""
+        key = hashlib.blake2b(json.dumps(schema, sort_keys=True).encode()).digest()
+        tool = cls._SCHEMA_CACHE.get(key)
+        if tool is None:
+            tool = {
+                "type": "function",
+                "function": _lower_types(schema)
+            }
+            cls._SCHEMA_CACHE[key] = tool
+        return tool
+
+    def _parse_gemini_response(self, response):
+        """Extracts (text, function_calls) from a Gemini response or stream chunk."""
+        fcs = []
+        text_parts = []
+
+        # Stream chunks can carry no candidate at all (e.g. the final usage-only chunk)
+        candidates = response.candidates
+        if not candidates:
+            return "", fcs
+
+        # Part.data is a oneof; presence checks ("field" in part) branch without raising
+        for part in candidates[0].content.parts:
+            if "function_call" in part:
+                fcs.append({"name": part.function_call.name, "args": dict(part.function_call.args), "id": None})
+            elif "text" in part:
+                text_parts.append(part.text)
+
+        return "\n".join(text_parts), fcs
+
+    async def _gemini_stream(self, content, on_text=None, on_tool_call=None):
+        """Streams one Gemini turn, reporting text and function calls as they arrive."""
+        self._apply_compaction()
+        text_parts = []
+        fcs = []
+        context_tokens = None
+        async with self.semaphore:
+            response = await self._call(lambda: self.chat_session.send_message_async(content, stream=True))
+            async for chunk in response:
+                if chunk.usage_metadata and chunk.usage_metadata.total_token_count:
+                    context_tokens = chunk.usage_metadata.total_token_count
+                text, chunk_fcs = self._parse_gemini_response(chunk)
+                if text:
+                    text_parts.append(text)
+                    if on_text:
+                        on_text(text)
+                for fc in chunk_fcs:
+                    fcs.append(fc)
+                    if on_tool_call:
+                        on_tool_call(fc)
+
+        self._maybe_compact(context_tokens)
+        return "".join(text_parts), fcs
+
+    async def _openai_complete(self, on_text=None, on_tool_call=None, **kwargs):
+        """Streams one chat completion against the current history and records the reply."""
+        self._apply_compaction()
+        text_parts = []
+        context_tokens = None
+        calls = [] # [{"id", "name", "arguments": [fragments]}] in index order
+        fcs = []
+
+        def finish(call):
+            # A call is complete once the stream moves past its index
+            fc = {
+                "name": call["name"],
+                "args": json.loads("".join(call["arguments"]) or "{}"),
+                "id": call["id"] # OpenAI needs this for response
+            }
+            fcs.append(fc)
+            if on_tool_call:
+                on_tool_call(fc)
+
+        async with self.semaphore:
+            stream = await self._call(lambda: self.client.chat.completions.create(
+                model=self.model_name,
+                messages=self.history,
+                tools=self.openai_tools if self.openai_tools else None,
+                stream=True,
+                stream_options={"include_usage": True},
+                **kwargs
+            ))
+            self.limiter.update_from_headers(stream.response.headers)
+            async for chunk in stream:
+                if chunk.usage:
+                    context_tokens = chunk.usage.total_tokens
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    text_parts.append(delta.content)
+                    if on_text:
+                        on_text(delta.content)
+                for t in delta.tool_calls or []:
+                    if t.index >= len(calls):
+                        if calls:
+                            finish(calls[-1])
+                        calls.append({"id": None, "name": "", "arguments": []})
+                    call = calls[t.index]
+                    if t.id:
+                        call["id"] = t.id
+                    if t.function and t.function.name:
+                        call["name"] += t.function.name
+                    if t.function and t.function.arguments:
+                        call["arguments"].append(t.function.arguments)
+
+        if calls:
+            finish(calls[-1])
+
+        text_response = "".join(text_parts)
+        # Add assistant message to history (important for context)
+        msg = {"role": "assistant", "content": text_response or None}
+        if calls:
+            msg["tool_calls"] = [
+                {
+                    "id": call["id"],
+                    "type": "function",
+                    "function": {"name": call["name"], "arguments": "".join(call["arguments"])}
+                }
+                for call in calls
+            ]
+        self.history.append(msg)
+        self._maybe_compact(context_tokens)
+
+        # OpenAI can return multiple calls; all of them are returned so the caller can fan them out.
+        return text_response, fcs
+
+    async def asend_message(self, message, on_text=None, on_tool_call=None):
         """
-        Sends a message and returns (text_response, function_call_info).
-        function_call_info is None if no call, or {"name": str, "args": dict}.
+        Sends a message and returns (text_response, function_calls).
+        function_calls is a (possibly empty) list of {"name": str, "args": dict, "id": str | None}.
+        The response is streamed: on_text(str) receives text fragments as they arrive and
+        on_tool_call(dict) receives each function call as soon as its arguments are complete.
         """
+        key = None
+        if LLM_CACHE:
+            key = hashlib.blake2b((self.history_hash() + message).encode(), digest_size=16).hexdigest()
+            with shelve.open(LLM_CACHE_PATH) as db:
+                cached = db.get(key)
+            if cached is not None:
+                if on_text:
+                    on_text(cached)
+                self.record_turn(message, cached)
+                return cached, []
+
         if self.provider == "gemini":
-            response = self.chat_session.send_message(message)
-            
-            # Check for function call
-            fc = None
-            text_response = ""
-            
-            try:
-                # Iterate parts to find function call
-                for part in response.parts:
-                    if part.function_call:
-                        fc = {"name": part.function_call.name, "args": dict(part.function_call.args)}
-                
-                # If there's a function call, response.text might fail
-                if not fc:
-                    text_response = response.text
-                else:
-                    # Optional: Check if there's also text parts, but for now safe default
-                    # response.text fails if multiple parts have different types or just function call
-                    # We try to extract text parts if any
-                    texts = [p.text for p in response.parts if p.text]
-                    text_response = "\n".join(texts)
-                    
-            except Exception:
-                # Fallback if accessing attributes fails
-                pass
-            
-            return text_response, fc
+            text_response, fcs = await self._gemini_stream(message, on_text, on_tool_call)
 
         elif self.provider == "openai":
             # Add user message to history
             self.history.append({"role": "user", "content": message})
-            
-            completion = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=self.history,
-                tools=self.openai_tools if self.openai_tools else None,
+            text_response, fcs = await self._openai_complete(
+                on_text, on_tool_call,
                 tool_choice="auto" if self.openai_tools else None
             )
-            
-            msg = completion.choices[0].message
-            # Add assistant message to history (important for context)
-            self.history.append(msg)
-
-            text_response = msg.content or ""
-            fc = None
-            
-            if msg.tool_calls:
-                # OpenAI can return multiple calls, but to keep it simple and consistent with our loop,
-                # we'll pick the first one or handle sequentially.
-                # For this simple agent, let's just take the first one.
-                t = msg.tool_calls[0]
-                fc = {
-                    "name": t.function.name,
-                    "args": json.loads(t.function.arguments),
-                    "id": t.id # OpenAI needs this for response
-                }
-                
-            return text_response, fc
 
-    def send_tool_result(self, tool_name, result, tool_call_id=None):
+        # Replies that call tools are never cached: replaying them would skip the Blender side effects
+        if key is not None and text_response and not fcs:
+            with shelve.open(LLM_CACHE_PATH) as db:
+                db[key] = text_response
+        return text_response, fcs
+
+    def history_hash(self):
+        """Content hash of everything besides the next message that shapes the reply: model, tools and conversation."""
+        # Hash the history the next request will actually be sent with
+        self._apply_compaction()
+        if self.provider == "gemini":
+            history = [type(c).to_dict(c) for c in self.chat_session.history]
+        else:
+            history = self.history
+        payload = json.dumps([self.model_name, self.tools_hash, history], sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    async def asend_tool_result(self, tool_results, on_text=None, on_tool_call=None):
         """
-        Sends the result of a tool execution back to the LLM.
+        Sends the results of one turn's tool executions back to the LLM.
+        tool_results is a list of (function_call, result) pairs, in call order.
+        Streaming callbacks behave as in asend_message.
         """
         if self.provider == "gemini":
-            # Gemini expects a FunctionResponse
-            response = self.chat_session.send_message(
-                self.genai.protos.Content(
-                    parts=[self.genai.protos.Part(
+            # Gemini expects one FunctionResponse part per call, in a single Content
+            content = self.genai.protos.Content(
+                parts=[
+                    self.genai.protos.Part(
                         function_response=self.genai.protos.FunctionResponse(
-                            name=tool_name,
+                            name=fc["name"],
                             response={"result": result}
                         )
-                    )]
-                )
+                    )
+                    for fc, result in tool_results
+                ]
             )
-            
-            # Check for function call
-            fc = None
-            text_parts = []
-            
-            try:
-                # Iterate parts to extract content safely
-                for part in response.parts:
-                    if part.function_call:
-                        fc = {"name": part.function_call.name, "args": dict(part.function_call.args)}
-                    else:
-                        # Try to extract text from non-function parts
-                        try:
-                            if part.text:
-                                text_parts.append(part.text)
-                        except:
-                            pass
-                
-                text_response = "\n".join(text_parts)
-                    
-            except Exception:
-                # Fallback
-                try: 
-                    text_response = response.text
-                except:
-                    pass
-            
-            return text_response, fc
+            return await self._gemini_stream(content, on_text, on_tool_call)
 
         elif self.provider == "openai":
-            # Add tool result to history
-            self.history.append({
-                "role": "tool",
-                "tool_call_id": tool_call_id,
-                "name": tool_name,
-                "content": str(result)
-            })
-            
+            # Add one tool message per call; every tool_call_id must be answered
+            for fc, result in tool_results:
+                self.history.append({
+                    "role": "tool",
+                    "tool_call_id": fc.get("id"),
+                    "name": fc["name"],
+                    "content": str(result)
+                })
+
             # Get follow-up response
-            completion = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=self.history,
-                tools=self.openai_tools if self.openai_tools else None
-            )
-            
-            msg = completion.choices[0].message
-            # Add assistant message to history
-            self.history.append(msg)
-            
-            text_response = msg.content or ""
-            fc = None
-            
-            if msg.tool_calls:
-                # OpenAI can return multiple calls, but to keep it simple and consistent with our loop,
-                # we'll pick the first one.
-                t = msg.tool_calls[0]
-                fc = {
-                    "name": t.function.name,
-                    "args": json.loads(t.function.arguments),
-                    "id": t.id 
-                }
-            
-            return text_response, fc
+            return await self._openai_complete(on_text, on_tool_call)
+
+    def record_turn(self, message, reply):
+        """Adds a turn answered without the model (e.g. replayed from a cache) to the conversation."""
+        reply = reply or "Done."
+        if self.provider == "gemini":
+            protos = self.genai.protos
+            self.chat_session.history = list(self.chat_session.history) + [
+                protos.Content(role="user", parts=[protos.Part(text=message)]),
+                protos.Content(role="model", parts=[protos.Part(text=reply)])
+            ]
+        elif self.provider == "openai":
+            self.history.append({"role": "user", "content": message})
+            self.history.append({"role": "assistant", "content": reply})
+
+    async def asend_batch(self, messages):
+        """
+        Sends up to BATCH_LIMIT independent prompts in a single request and returns
+        a list of function calls, one per prompt where the model produced a valid one.
+        Batches are stateless: they neither read nor extend the chat history.
+        """
+        if len(messages) > self.BATCH_LIMIT:
+            raise ValueError(f"At most {self.BATCH_LIMIT} prompts per batch")
+
+        prompt = self.batch_header + BATCH_PROMPT_REQUESTS.format(
+            n=len(messages),
+            prompts="\n".join(f"<<PROMPT {i}>>\n{m}\n<<END {i}>>" for i, m in enumerate(messages, 1))
+        )
+
+        if self.provider == "gemini":
+            async with self.semaphore:
+                response = await self._call(lambda: self._plain_model().generate_content_async(
+                    prompt,
+                    generation_config={"response_mime_type": "application/json"}
+                ))
+            # Not response.text: that raises ValueError for a blocked or empty candidate
+            text_response = self._parse_gemini_response(response)[0]
+
+        elif self.provider == "openai":
+            async with self.semaphore:
+                completion = await self._call(lambda: self.client.chat.completions.create(
+                    model=self.model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                    response_format={"type": "json_object"}
+                ))
+            text_response = completion.choices[0].message.content or ""
+
+        try:
+            calls = json.loads(text_response).get("calls", [])
+            if not isinstance(calls, list):
+                raise ValueError("'calls' is not a list")
+        except (ValueError, AttributeError) as e: # Not JSON, or not a JSON object
+            sys.stderr.write(f"[LLMClient] Ignoring malformed batch response: {e}\n")
+            return []
+        tool_names = {t["name"] for t in self.tools}
+        return [
+            {"name": c["name"], "args": c.get("args") or {}, "id": None}
+            for c in calls
+            if isinstance(c, dict) and c.get("name") in tool_names and isinstance(c.get("args") or {}, dict)
+        ]
+
+    def _maybe_compact(self, context_tokens):
+        """Starts summarizing old turns in the background once the context gets too long."""
+        if context_tokens is None:
+            # Provider didn't report usage; estimate ~4 characters per token
+            context_tokens = len(str(self.chat_session.history if self.provider == "gemini" else self.history)) // 4
+        self.context_tokens = context_tokens
+        if context_tokens <= MAX_CONTEXT_TOKENS or self.compaction is not None:
+            return
+        self.compaction = asyncio.create_task(self._compact())
+
+    async def _compact(self):
+        """Returns (cut, summary) for everything before the last KEEP_TURNS user turns, or None."""
+        try:
+            if self.provider == "gemini":
+                history = self.chat_session.history
+                turns = [i for i, c in enumerate(history) if c.role == "user" and any("text" in p for p in c.parts)]
+                if len(turns) <= KEEP_TURNS:
+                    return None
+                cut = turns[-KEEP_TURNS]
+                lines = []
+                for c in history[:cut]:
+                    for p in c.parts:
+                        if "function_call" in p:
+                            lines.append(f"{c.role} called {p.function_call.name}({_clip(dict(p.function_call.args))})")
+                        elif "function_response" in p:
+                            lines.append(f"tool {p.function_response.name}: {_clip(dict(p.function_response.response))}")
+                        elif "text" in p:
+                            lines.append(f"{c.role}: {p.text}")
+
+                async with self.semaphore:
+                    response = await self._call(lambda: self._plain_model().generate_content_async([SUMMARY_PROMPT, "\n".join(lines)]))
+                return cut, response.text
+
+            elif self.provider == "openai":
+                turns = [i for i in range(self.pinned, len(self.history)) if self.history[i]["role"] == "user"]
+                if len(turns) <= KEEP_TURNS:
+                    return None
+                cut = turns[-KEEP_TURNS]
+                lines = []
+                for m in self.history[self.pinned:cut]:
+                    if m["role"] == "tool":
+                        # Already reflected in the assistant's follow-up; keep only a stub
+                        lines.append(f"tool {m.get('name')}: {_clip(m['content'])}")
+                        continue
+                    if m.get("content"):
+                        lines.append(f"{m['role']}: {m['content']}")
+                    for t in m.get("tool_calls") or []:
+                        lines.append(f"{m['role']} called {t['function']['name']}({_clip(t['function']['arguments'])})")
+
+                async with self.semaphore:
+                    completion = await self._call(lambda: self.client.chat.completions.create(
+                        model=self.model_name,
+                        messages=[
+                            {"role": "system", "content": SUMMARY_PROMPT},
+                            {"role": "user", "content": "\n".join(lines)}
+                        ]
+                    ))
+                return cut, completion.choices[0].message.content or ""
+
+        except Exception as e:
+            sys.stderr.write(f"[LLMClient] History summarization failed: {e}\n")
+            return None
+
+    def _apply_compaction(self):
+        """Swaps summarized turns for their summary. History only grows meanwhile, so cut is still valid."""
+        if self.compaction is None or not self.compaction.done():
+            return
+        task, self.compaction = self.compaction, None
+        result = task.result()
+        if result is None:
+            return
+        cut, summary = result
+        if self.provider == "gemini":
+            protos = self.genai.protos
+            history = list(self.chat_session.history)
+            self.chat_session.history = [
+                protos.Content(role="user", parts=[protos.Part(text=f"Summary of the earlier conversation:\n{summary}")]),
+                protos.Content(role="model", parts=[protos.Part(text="Understood.")])
+            ] + history[cut:]
+        else:
+            self.history[self.pinned:cut] = [
+                {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+            ]
@@ -0,0 +1,97 @@
+import re
+import sys
+import time
+import random
+import asyncio
+
+# Delays like "1s", "6m0s", "20ms" in x-ratelimit-reset-* headers
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def _parse_duration(value):
+    parts = _DURATION_PART.findall(value or "")
+    if not parts:
+        return None
+    return sum(float(n) * _UNIT_SECONDS[unit] for n, unit in parts)
+
+def _retry_after(error):
+    """Seconds the provider asked us to wait, from a Retry-After header if the error carries one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return _parse_duration(headers.get("x-ratelimit-reset-requests"))
+
+class RateLimiter:
+    """
+    Request and token buckets (per minute) shared by every call of one client.
+    A limit of 0 disables that bucket. Buckets refill continuously as they are read.
+    """
+    def __init__(self, rpm=0, tpm=0):
+        self.capacity = {"requests": rpm, "tokens": tpm}
+        self.available = dict(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        for bucket, cap in self.capacity.items():
+            if cap:
+                self.available[bucket] = min(cap, self.available[bucket] + cap * elapsed / 60)
+
+    async def acquire(self, est_tokens=0):
+        """Waits until one request costing about est_tokens fits under both limits."""
+        cost = {"requests": 1, "tokens": est_tokens}
+        async with self.lock:
+            while True:
+                self._refill()
+                wait = self.paused_until - time.monotonic()
+                for bucket, cap in self.capacity.items():
+                    if cap:
+                        # Never wait for more than a full bucket
+                        short = min(cost[bucket], cap) - self.available[bucket]
+                        if short > 0:
+                            wait = max(wait, short * 60 / cap)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            for bucket, cap in self.capacity.items():
+                if cap:
+                    self.available[bucket] -= min(cost[bucket], cap)
+
+    def pause(self, seconds):
+        """Holds every caller back for at least seconds (e.g. after a 429)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        """Follows OpenAI's x-ratelimit-* headers when the provider says a bucket is empty."""
+        for bucket in ("requests", "tokens"):
+            if headers.get(f"x-ratelimit-remaining-{bucket}") == "0":
+                reset = _parse_duration(headers.get(f"x-ratelimit-reset-{bucket}"))
+                if reset:
+                    self.pause(reset)
+
+async def with_retries(make_call, limiter, retry_on, est_tokens=0, max_tries=6):
+    """
+    Awaits make_call() under the rate limiter, retrying retry_on errors with
+    exponential backoff and full jitter, or the provider's Retry-After when given.
+    """
+    for attempt in range(1, max_tries + 1):
+        await limiter.acquire(est_tokens)
+        try:
+            return await make_call()
+        except retry_on as e:
+            if attempt == max_tries:
+                raise
+            delay = _retry_after(e) or random.uniform(0, min(60, 2 ** attempt))
+            limiter.pause(delay)
+            # stderr only: stdout belongs to the REPL and streamed text
+            sys.stderr.write(f"[LLMClient] {type(e).__name__}; retry {attempt}/{max_tries - 1} in {delay:.1f}s\n")
+            sys.stderr.flush()
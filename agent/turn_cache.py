@@ -0,0 +1,47 @@
+import os
+import json
+
+class TurnCache:
+    """
+    Remembers the tool calls and final reply of successful turns so a repeated
+    prompt can be replayed against Blender without calling the LLM.
+    Prompts match after case-folding and collapsing whitespace, and only in the
+    same context (LLMClient.history_hash()), so "make it darker" never replays
+    calls recorded against another conversation.
+    """
+    def __init__(self, path=os.path.join("output", "turn_cache.json")):
+        self.path = path
+        self.entries = None # Loaded on first use
+        self.dirty = False
+
+    @staticmethod
+    def key(text, context):
+        return context + ":" + " ".join(text.casefold().split())
+
+    def _load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (FileNotFoundError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def get(self, text, context):
+        """Returns {"calls": [[name, args], ...], "text": str} or None."""
+        return self._load().get(self.key(text, context))
+
+    def put(self, text, context, calls, final_text):
+        self._load()[self.key(text, context)] = {
+            "calls": [[name, args] for name, args in calls],
+            "text": final_text
+        }
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        self.dirty = False
@@ -0,0 +1,117 @@
+import os
+import sys
+import queue
+import socket
+import threading
+
+# Add current directory to path so we can import server
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import server
+    from socket_path import default_socket_path
+except ImportError:
+    # Fallback if running from root
+    import blender_server.server as server
+    from blender_server.socket_path import default_socket_path
+
+# The agent always passes BLENDER_MCP_SOCKET; the default covers manual runs
+SOCKET_PATH = os.getenv("BLENDER_MCP_SOCKET") or default_socket_path()
+# JSON-RPC error code sent (with a null id) to sessions turned away while another is connected
+BUSY_ERROR = -32000
+# Seconds a new session waits for the current one to finish before being turned away
+ADMIT_TIMEOUT = 2
+
+def log(msg):
+    server.log(f"[Daemon] {msg}")
+
+def is_running(path):
+    """True if another daemon is already accepting on path."""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+def _reject(conn):
+    """Tells a session the daemon is serving someone else, then waits for it to hang up."""
+    with conn:
+        try:
+            with conn.makefile("wb") as writer:
+                server.write_message(writer, {
+                    "jsonrpc": "2.0",
+                    "id": None,
+                    "error": {"code": BUSY_ERROR, "message": "Blender daemon is busy with another session"}
+                })
+            conn.shutdown(socket.SHUT_WR)
+            # Closing first would fail the client's initialize write before it reads the error
+            conn.settimeout(5)
+            while conn.recv(4096):
+                pass
+        except OSError:
+            pass
+
+def _admit(conn, busy, sessions):
+    # A session that just hung up may still be flushing; give it a moment before refusing
+    if busy.acquire(timeout=ADMIT_TIMEOUT):
+        sessions.put(conn)
+    else:
+        log("Rejected a second session")
+        _reject(conn)
+
+def _accept_loop(sock, busy, sessions):
+    """Hands one connection at a time to the main thread (bpy must run there) and rejects the rest."""
+    while True:
+        try:
+            conn, _ = sock.accept()
+        except OSError: # Listening socket closed on shutdown
+            return
+        threading.Thread(target=_admit, args=(conn, busy, sessions), daemon=True).start()
+
+def main():
+    if is_running(SOCKET_PATH):
+        log(f"Already running on {SOCKET_PATH}")
+        return
+
+    # Stale socket file left by a previous daemon
+    if os.path.exists(SOCKET_PATH):
+        os.remove(SOCKET_PATH)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(SOCKET_PATH)
+    sock.listen(8)
+    log(f"Listening on {SOCKET_PATH}")
+
+    # Accepting happens on a thread so a second session gets an answer instead of waiting in the backlog.
+    # busy is held for the whole session and released here on the main thread.
+    busy = threading.Lock()
+    sessions = queue.Queue()
+    threading.Thread(target=_accept_loop, args=(sock, busy, sessions), daemon=True).start()
+
+    try:
+        # One client at a time; each initialize resets the scene (utils.start_session)
+        while True:
+            conn = sessions.get()
+            log("Client connected")
+            shutdown = False
+            # Closing the writer can raise too, when a reply is still buffered for a client that hung up
+            try:
+                with conn, conn.makefile("rb", buffering=server.BUFFER_SIZE) as reader, conn.makefile("wb", buffering=server.BUFFER_SIZE) as writer:
+                    shutdown = server.serve(reader, writer)
+            except OSError as e:
+                log(f"Connection lost: {e}")
+            if shutdown:
+                log("Shutdown requested")
+                break
+            log("Client disconnected")
+            busy.release()
+    finally:
+        sock.close()
+        if os.path.exists(SOCKET_PATH):
+            os.remove(SOCKET_PATH)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,19 @@
 import sys
 import json
+import queue
+import threading
 import traceback
 
+# Blender's bundled Python usually lacks orjson; fall back to the stdlib
+try:
+    import orjson
+    json_dumps = orjson.dumps # -> bytes
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    json_loads = json.loads
+
 # Add current directory to path so we can import utils
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -17,6 +29,95 @@ def log(msg):
     sys.stderr.write(f"[BlenderServer] {msg}\n")
     sys.stderr.flush()
 
+# Stream buffer size; frames carrying generated code often exceed the default 8KB
+BUFFER_SIZE = 65536
+
+# Queued blend saves are written once no request has arrived for this long (seconds)
+SAVE_IDLE_INTERVAL = 0.5
+
+TOOLS = [
+    {
+        "name": "create_procedural_material",
+        "description": "Create a procedural material in Blender using Python code. The code has access to 'bpy', 'material' (the material object), 'nodes', and 'links'.",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string", "description": "Name of the material"},
+                "python_code": {"type": "string", "description": "Python code using bpy to create nodes. e.g. 'node_tex = nodes.new(\"ShaderNodeTexNoise\")'"}
+            },
+            "required": ["name", "python_code"]
+        }
+    },
+    {
+        "name": "list_materials",
+        "description": "List all existing materials in the Blender file.",
+        "inputSchema": {
+            "type": "object",
+            "properties": {},
+        }
+    },
+    {
+        "name": "save_blend_file",
+        "description": "Save the current Blender file to disk.",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "filepath": {"type": "string", "description": "Path to save the .blend file (e.g., 'output.blend')"}
+            },
+            "required": ["filepath"]
+        }
+    }
+]
+
+# Static results, serialized once at import
+_INITIALIZE_RESULT = json_dumps({
+    "protocolVersion": "2024-11-05", # MCP version
+    "capabilities": {
+        "tools": {}
+    },
+    "serverInfo": {
+        "name": "BlenderMCP",
+        "version": "0.1.0"
+    }
+})
+_TOOLS_LIST_RESULT = json_dumps({"tools": TOOLS})
+
+def _result_response(req_id, result_json):
+    """Splices a pre-serialized result into a JSON-RPC response envelope."""
+    return b'{"jsonrpc":"2.0","id":' + json_dumps(req_id) + b',"result":' + result_json + b'}'
+
+# Serialized list_materials() result, reused while utils returns the same cached list
+_MATERIALS_JSON = {"list": None, "text": None}
+
+def read_message(stream):
+    """Reads one Content-Length framed JSON-RPC message. Returns None on EOF."""
+    length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            if length is not None:
+                break # End of headers
+            continue
+        name, sep, value = line.partition(b":")
+        if sep and name.strip().lower() == b"content-length":
+            length = int(value)
+
+    body = stream.read(length)
+    if len(body) < length:
+        return None
+    return json_loads(body)
+
+def write_message(stream, msg):
+    # Pre-serialized responses arrive as bytes
+    body = msg if isinstance(msg, bytes) else json_dumps(msg)
+    # Header and body go out in a single write(). The leading CRLF keeps the header on its
+    # own line even if generated code printed to stdout without a trailing newline.
+    stream.write(f"\r\nContent-Length: {len(body)}\r\n\r\n".encode("ascii") + body)
+    stream.flush()
+
 def handle_request(request):
     method = request.get("method")
     params = request.get("params", {})
@@ -25,65 +126,24 @@ def handle_request(request):
     log(f"Received request: {method}")
 
     if method == "initialize":
-        return {
-            "jsonrpc": "2.0",
-            "id": req_id,
-            "result": {
-                "protocolVersion": "2024-11-05", # MCP version
-                "capabilities": {
-                    "tools": {}
-                },
-                "serverInfo": {
-                    "name": "BlenderMCP",
-                    "version": "0.1.0"
-                }
-            }
-        }
+        # The daemon outlives the session that launched it: start each client from a clean
+        # scene, as a fresh Blender would, and follow the client's directory
+        for filepath, error in utils.start_session():
+            log(f"Failed to save {filepath}: {error}")
+        cwd = params.get("cwd")
+        if cwd:
+            try:
+                os.chdir(cwd)
+            except OSError as e:
+                log(f"Cannot change to client directory {cwd}: {e}")
+        return _result_response(req_id, _INITIALIZE_RESULT)
     
     elif method == "notifications/initialized":
         # Sent after initialization
         return None 
 
     elif method == "tools/list":
-        return {
-            "jsonrpc": "2.0",
-            "id": req_id,
-            "result": {
-                "tools": [
-                    {
-                        "name": "create_procedural_material",
-                        "description": "Create a procedural material in Blender using Python code. The code has access to 'bpy', 'material' (the material object), 'nodes', and 'links'.",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "name": {"type": "string", "description": "Name of the material"},
-                                "python_code": {"type": "string", "description": "Python code using bpy to create nodes. e.g. 'node_tex = nodes.new(\"ShaderNodeTexNoise\")'"}
-                            },
-                            "required": ["name", "python_code"]
-                        }
-                    },
-                    {
-                        "name": "list_materials",
-                        "description": "List all existing materials in the Blender file.",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {},
-                        }
-                    },
-                    {
-                        "name": "save_blend_file",
-                        "description": "Save the current Blender file to disk.",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "filepath": {"type": "string", "description": "Path to save the .blend file (e.g., 'output.blend')"}
-                            },
-                            "required": ["filepath"]
-                        }
-                    }
-                ]
-            }
-        }
+        return _result_response(req_id, _TOOLS_LIST_RESULT)
 
     elif method == "tools/call":
         tool_name = params.get("name")
@@ -101,7 +161,10 @@ def handle_request(request):
             
         elif tool_name == "list_materials":
             mats = utils.list_materials()
-            result_content.append({"type": "text", "text": json.dumps(mats)})
+            if mats is not _MATERIALS_JSON["list"]:
+                _MATERIALS_JSON["list"] = mats
+                _MATERIALS_JSON["text"] = json_dumps(mats).decode("utf-8")
+            result_content.append({"type": "text", "text": _MATERIALS_JSON["text"]})
 
         elif tool_name == "save_blend_file":
             filepath = args.get("filepath")
@@ -126,37 +189,91 @@ def handle_request(request):
         }
 
     elif method == "ping":
-        return {
-            "jsonrpc": "2.0",
-            "id": req_id,
-            "result": {}
-        }
+        return _result_response(req_id, b"{}")
+
+    elif method == "shutdown":
+        # serve() stops once this is answered
+        return _result_response(req_id, b"{}")
         
     return None
 
-def main():
-    log("Starting Blender MCP Server...")
-    while True:
+def _handle_batch(requests):
+    """Runs a JSON-RPC batch in order. Returns the serialized response array, or None if nothing needs an answer."""
+    bodies = []
+    for request in requests:
         try:
-            line = sys.stdin.readline()
-            if not line:
-                break
-            
-            line = line.strip()
-            if not line:
-                continue
-                
-            request = json.loads(line)
             response = handle_request(request)
+        except Exception as e:
+            log(f"Error: {traceback.format_exc()}")
+            # Answer anyway; the client waits for every id in the batch
+            response = request.get("id") is not None and {
+                "jsonrpc": "2.0",
+                "id": request["id"],
+                "error": {"code": -32603, "message": str(e)}
+            }
+        if response:
+            bodies.append(response if isinstance(response, bytes) else json_dumps(response))
+    return b"[" + b",".join(bodies) + b"]" if bodies else None
+
+def _read_loop(reader, inbox):
+    """Reader thread: queues decoded requests, then None at EOF."""
+    try:
+        while True:
+            try:
+                request = read_message(reader)
+            except ValueError: # Bad Content-Length or JSONDecodeError
+                log("Invalid message received")
+                continue
+            inbox.put(request)
+            if request is None:
+                return
+    except Exception:
+        log(f"Error: {traceback.format_exc()}")
+        inbox.put(None)
+
+def _flush_saves():
+    for filepath, error in utils.flush_pending_saves():
+        log(f"Failed to save {filepath}: {error}")
+
+def serve(reader, writer):
+    """Answers framed requests from reader on writer until EOF. Returns True if asked to shut down."""
+    # Reading happens on a thread so this (main) thread can run queued saves while idle
+    inbox = queue.Queue()
+    threading.Thread(target=_read_loop, args=(reader, inbox), daemon=True).start()
+    while True:
+        try:
+            request = inbox.get(timeout=SAVE_IDLE_INTERVAL)
+        except queue.Empty:
+            _flush_saves()
+            continue
+        if request is None:
+            break
+
+        try:
+            if isinstance(request, list):
+                response = _handle_batch(request)
+            else:
+                response = handle_request(request)
             
             if response:
-                sys.stdout.write(json.dumps(response) + "\n")
-                sys.stdout.flush()
+                write_message(writer, response)
                 
-        except json.JSONDecodeError:
-            log("Invalid JSON received")
         except Exception as e:
             log(f"Error: {traceback.format_exc()}")
 
+        if isinstance(request, dict) and request.get("method") == "shutdown":
+            _flush_saves()
+            return True
+
+    _flush_saves()
+    return False
+
+def main():
+    log("Starting Blender MCP Server...")
+    # Replace sys.stdin.buffer's 8KB buffer so a frame is read with few syscalls. Responses keep
+    # using sys.stdout.buffer, which print() also writes through, so their order is preserved.
+    reader = open(sys.stdin.fileno(), "rb", buffering=BUFFER_SIZE, closefd=False)
+    serve(reader, sys.stdout.buffer)
+
 if __name__ == "__main__":
     main()
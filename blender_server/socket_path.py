@@ -0,0 +1,22 @@
+import os
+import stat
+import tempfile
+
+# Shared by the agent (main.py) and the daemon; must not import bpy
+
+def default_socket_path():
+    """
+    Daemon socket in a per-user 0700 directory that other local users can't reach or fake:
+    $XDG_RUNTIME_DIR/blender-mcp, or blender-mcp-<uid> in the temp dir.
+    """
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        directory = os.path.join(runtime_dir, "blender-mcp")
+    else:
+        directory = os.path.join(tempfile.gettempdir(), f"blender-mcp-{os.getuid()}")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    # A directory planted by someone else (or opened up later) could hold an impostor socket
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise RuntimeError(f"Refusing to use {directory}: it must be a directory owned by you with mode 0700")
+    return os.path.join(directory, "blender-mcp.sock")
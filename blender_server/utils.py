@@ -1,5 +1,31 @@
 import bpy
+import bmesh
 import os
+import re
+import hashlib
+import functools
+
+# Bumped whenever a tool may have added or replaced materials
+_MAT_VERSION = 0
+_MAT_CACHE = {"stamp": -1, "list": None}
+
+# Blend files waiting to be written, in request order. Blender ops must run on the main
+# thread, so the server loop flushes these when it goes idle instead of a worker thread.
+# A save writes the scene as it is when flushed, so only saves to one path may coalesce.
+_PENDING_SAVES = {}
+
+# Matches exactly the characters for which str.isalnum() is False (\w is alnum plus "_")
+_UNSAFE_CHARS = re.compile(r"\W")
+
+PREVIEW_NAME = "PreviewSphere"
+# Handle to the preview object, resolved once per Blender process
+_PREVIEW_OBJ = None
+
+# Compiled code objects kept so repeated generations skip the parse/compile step; bounded
+# because the daemon process lives indefinitely
+COMPILE_CACHE_SIZE = 32
+# Material name -> (code hash, absolute .py path) of its last successful build
+_LAST_CODE = {}
 
 def delete_default_cube():
     """Deletes the default Cube object if it exists."""
@@ -7,60 +33,168 @@ def delete_default_cube():
     if cube:
         bpy.data.objects.remove(cube, do_unlink=True)
 
+def get_preview_object():
+    """Returns the smooth-shaded preview sphere, building it directly through bpy.data (no operators/undo)."""
+    global _PREVIEW_OBJ
+    if _PREVIEW_OBJ is not None:
+        try:
+            _PREVIEW_OBJ.name # Raises ReferenceError once the object has been removed
+            return _PREVIEW_OBJ
+        except ReferenceError:
+            _PREVIEW_OBJ = None
+
+    obj = bpy.data.objects.get(PREVIEW_NAME)
+    if not obj:
+        mesh = bpy.data.meshes.new(f"{PREVIEW_NAME}Mesh")
+        bm = bmesh.new()
+        # primitive_uv_sphere_add creates a "UVMap"; materials using UV/tangent coordinates need it
+        bm.loops.layers.uv.new("UVMap")
+        bmesh.ops.create_uvsphere(bm, u_segments=32, v_segments=16, radius=1.0, calc_uvs=True)
+        bm.to_mesh(mesh)
+        bm.free()
+        mesh.polygons.foreach_set("use_smooth", [True] * len(mesh.polygons))
+        mesh.update()
+
+        obj = bpy.data.objects.new(PREVIEW_NAME, mesh)
+        bpy.context.collection.objects.link(obj)
+
+    _PREVIEW_OBJ = obj
+    return obj
+
+@functools.lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def _compile(python_code, name):
+    return compile(python_code, f"<mat:{name}>", "exec")
+
+def _assign_preview(mat):
+    obj = get_preview_object()
+    if not obj.data.materials:
+        obj.data.materials.append(mat)
+    else:
+        obj.data.materials[0] = mat
+
+def _report_failed_saves(msg, failed_saves):
+    for filepath, error in failed_saves:
+        msg += f"\nEarlier save to '{filepath}' failed: {error}"
+    return msg
+
 def create_procedural_material(name: str, python_code: str):
     """
     Creates or overwrites a material with the given name and executes the python_code
     to generate nodes.
     """
+    # Prepare output directory
+    output_dir = "output"
+    safe_name = _UNSAFE_CHARS.sub("_", name)
+    py_filename = os.path.join(output_dir, f"{safe_name}.py")
+    blend_filename = os.path.join(output_dir, f"{safe_name}.blend")
+    # Same code written to the same place; a session elsewhere still gets its own files
+    build = (hashlib.blake2b(python_code.encode("utf-8"), digest_size=16).digest(), os.path.abspath(py_filename))
+
+    # Queued saves capture the scene at flush time; write other materials' files before this one changes it
+    failed_saves = []
+    if any(path != os.path.abspath(blend_filename) for path in _PENDING_SAVES):
+        failed_saves = flush_pending_saves()
+
+    # The LLM regenerated identical code for a material that still exists
+    mat = bpy.data.materials.get(name)
+    if mat and _LAST_CODE.get(name) == build:
+        _assign_preview(mat)
+        return True, _report_failed_saves(f"Material '{name}' already created from identical code (cache hit).", failed_saves)
+
     # Execution environment
     local_vars = {}
     
     delete_default_cube()
+    # Whatever happens below, the material no longer matches its previous code
+    _LAST_CODE.pop(name, None)
     
     try:
         # We wrap the code to ensure it runs
-        exec(python_code, globals(), local_vars)
-
-        # Auto-Assign to Preview Object
-        preview_name = "PreviewSphere"
-        obj = bpy.data.objects.get(preview_name)
-        if not obj:
-            bpy.ops.mesh.primitive_uv_sphere_add(radius=1.0, location=(0, 0, 0))
-            obj = bpy.context.active_object
-            obj.name = preview_name
-            bpy.ops.object.shade_smooth()
+        exec(_compile(python_code, name), globals(), local_vars)
+
+        # Auto-Assign to Preview Object (built even if the script made no material)
+        get_preview_object()
         
         # Find the material (assuming the script created it with the given name)
         mat = bpy.data.materials.get(name)
         if mat:
-            if not obj.data.materials:
-                obj.data.materials.append(mat)
-            else:
-                obj.data.materials[0] = mat
+            _assign_preview(mat)
         
-        # Prepare output directory
-        output_dir = "output"
         os.makedirs(output_dir, exist_ok=True)
         
-        safe_name = "".join([c if c.isalnum() else "_" for c in name])
-        
         # Save Python code
-        py_filename = os.path.join(output_dir, f"{safe_name}.py")
         with open(py_filename, "w") as f:
             f.write(python_code)
             
-        # Auto-save Blend file
-        blend_filename = os.path.join(output_dir, f"{safe_name}.blend")
-        bpy.ops.wm.save_as_mainfile(filepath=blend_filename)
+        # Auto-save Blend file, off the request path
+        queue_save(blend_filename)
         
-        return True, f"Material '{name}' created. Saved code to '{py_filename}' and blend to '{blend_filename}'"
+        if mat:
+            _LAST_CODE[name] = build
+        msg = f"Material '{name}' created. Saved code to '{py_filename}'; blend save to '{blend_filename}' queued"
+        return True, _report_failed_saves(msg, failed_saves)
     except Exception as e:
         return False, f"Error creating material: {str(e)}"
+    finally:
+        # The generated code may have touched materials even if it failed
+        _invalidate_materials()
+
+def _invalidate_materials():
+    global _MAT_VERSION
+    _MAT_VERSION += 1
+
+def queue_save(filepath: str):
+    """Schedules a save of the current file; repeated requests for one path coalesce."""
+    # Absolute, so the save lands where it was requested even if the working directory changes first
+    filepath = os.path.abspath(filepath)
+    _PENDING_SAVES.pop(filepath, None)
+    _PENDING_SAVES[filepath] = None
+
+def flush_pending_saves():
+    """
+    Writes every queued blend file. Must be called from Blender's main thread.
+    Returns a list of (filepath, error message) for saves that failed.
+    """
+    failures = []
+    while _PENDING_SAVES:
+        filepath = next(iter(_PENDING_SAVES))
+        del _PENDING_SAVES[filepath]
+        try:
+            bpy.ops.wm.save_as_mainfile(filepath=filepath)
+        except Exception as e:
+            failures.append((filepath, str(e)))
+    return failures
+
+# Sessions served by this Blender process; every one after the first starts from a fresh scene
+_SESSIONS = 0
+
+def start_session():
+    """
+    Gives a new client the scene a freshly launched Blender would have: writes saves the
+    previous client queued, reloads the startup file and drops the per-scene caches.
+    Returns the failed saves, like flush_pending_saves().
+    """
+    global _SESSIONS, _PREVIEW_OBJ
+    failures = flush_pending_saves()
+    if _SESSIONS:
+        bpy.ops.wm.read_homefile()
+        _PREVIEW_OBJ = None
+        _LAST_CODE.clear()
+        _invalidate_materials()
+    _SESSIONS += 1
+    return failures
 
 def list_materials():
-    return [m.name for m in bpy.data.materials]
+    """Returns material names, cached until a mutating tool runs. Callers must not modify the list."""
+    # The length check also catches materials removed behind the tools' back
+    if _MAT_CACHE["stamp"] != _MAT_VERSION or len(_MAT_CACHE["list"]) != len(bpy.data.materials):
+        _MAT_CACHE["list"] = [m.name for m in bpy.data.materials]
+        _MAT_CACHE["stamp"] = _MAT_VERSION
+    return _MAT_CACHE["list"]
 
 def save_blend_file(filepath: str):
+    # Write queued saves first so they can't land after this one
+    flush_pending_saves()
     try:
         bpy.ops.wm.save_as_mainfile(filepath=filepath)
         return True, f"Saved to {filepath}"
@@ -1,54 +1,224 @@
 import os
 import sys
 import json
+import socket
+import hashlib
 import subprocess
 import time
 import threading
 import itertools
+import asyncio
 
 from dotenv import load_dotenv
-from agent.llm import LLMClient
+from agent.llm import LLMClient, close_http_client
+from agent.turn_cache import TurnCache
+from blender_server.socket_path import default_socket_path
+
+# orjson is optional; MCP messages fall back to the stdlib encoder
+try:
+    import orjson
+    json_dumps = orjson.dumps # -> bytes
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    json_loads = json.loads
 
 # Load environment variables
 load_dotenv(override=True)
 
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
 BLENDER_PATH = os.getenv("BLENDER_PATH", "blender")
+PIPE_BUFFER_SIZE = 65536
+BLENDER_MCP_SOCKET = os.getenv("BLENDER_MCP_SOCKET") # Default: see daemon_socket_path()
+# Replay tool calls of earlier identical prompts instead of asking the LLM again
+TURN_CACHE = os.getenv("TURN_CACHE", "0") == "1"
+DAEMON_START_TIMEOUT = 60 # seconds; Blender cold-start can take a while
+SERVER_EXIT_TIMEOUT = 30 # seconds a closing stdio server gets to write queued saves
+# Seconds to wait for any MCP reply before giving up on the call; 0 waits forever.
+# Generous: it also covers slow generated code and a blend save flushed just before the reply.
+MCP_TIMEOUT = float(os.getenv("MCP_TIMEOUT", "120"))
+
+def daemon_socket_path():
+    """BLENDER_MCP_SOCKET if set, else the per-user default shared with the daemon."""
+    return BLENDER_MCP_SOCKET or default_socket_path()
+
+# Error code the daemon uses to turn a session away while another one is connected
+DAEMON_BUSY = -32000
+
+class DaemonBusyError(RuntimeError):
+    pass
+
+class MCPTimeoutError(RuntimeError):
+    pass
 
 class BlenderMCPClient:
     def __init__(self, blender_path):
         self.blender_path = blender_path
         self.process = None
+        self.sock = None
+        self.reader = None
+        self.writer = None
         self.request_id = 0
+        # The pipe carries one request/response exchange at a time
+        self.lock = threading.Lock()
+        # Async callers queue here first: asyncio.Lock is FIFO, so calls run in dispatch order
+        self.async_lock = asyncio.Lock()
 
     def start(self):
-        # Server script is in blender_server/server.py relative to project root
-        server_script = os.path.join(os.path.dirname(__file__), "blender_server", "server.py")
-        cmd = [
+        if hasattr(socket, "AF_UNIX"):
+            self._connect_daemon()
+        else:
+            # No Unix domain sockets (e.g. Windows): run a private server over stdio
+            self._spawn_server()
+        self._initialize()
+        print("Blender MCP Connected.")
+
+    def _initialize(self):
+        # Initialize MCP Handshake
+        self._send_request("initialize", {
+            "protocolVersion": "2024-11-05", # MCP version
+            "capabilities": {},
+            "clientInfo": {"name": "BlenderAgent", "version": "0.1.0"},
+            # A shared daemon resolves output/ and relative save paths against this session's directory
+            "cwd": os.getcwd()
+        })
+        self._waiting_response() # Wait for initialize response
+        
+        self._send_notification("notifications/initialized", {})
+
+    def _blender_cmd(self, script):
+        # Server scripts are in blender_server/ relative to project root
+        server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blender_server", script)
+        return [
             self.blender_path,
             "--background",
             "--python", server_script
         ]
+
+    def _spawn_server(self):
+        cmd = self._blender_cmd("server.py")
         print(f"Starting Blender server: {' '.join(cmd)}")
         self.process = subprocess.Popen(
             cmd,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=sys.stderr, # Forward stderr
-            text=True,
-            bufsize=1 # Line buffered
+            bufsize=PIPE_BUFFER_SIZE # Binary pipes, framed by Content-Length
         )
-        
-        # Initialize MCP Handshake
-        self._send_request("initialize", {
-            "protocolVersion": "2024-11-05", # MCP version
-            "capabilities": {},
-            "clientInfo": {"name": "BlenderAgent", "version": "0.1.0"}
-        })
-        self._waiting_response() # Wait for initialize response
-        
-        self._send_notification("notifications/initialized", {})
-        print("Blender MCP Connected.")
+        self.reader = self.process.stdout
+        self.writer = self.process.stdin
+
+    def _connect_daemon(self):
+        """Connects to the long-lived Blender daemon, launching it on first use."""
+        path = daemon_socket_path()
+        daemon = None
+        delay = 0.1
+        deadline = time.monotonic() + DAEMON_START_TIMEOUT
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(path)
+                break
+            except (ConnectionRefusedError, FileNotFoundError):
+                sock.close()
+
+            if daemon is None:
+                cmd = self._blender_cmd("daemon.py")
+                print(f"Starting Blender daemon: {' '.join(cmd)}")
+                # Detached so it outlives this session; its log goes next to the socket
+                with open(path + ".log", "ab") as log_file:
+                    daemon = subprocess.Popen(
+                        cmd,
+                        stdin=subprocess.DEVNULL,
+                        stdout=subprocess.DEVNULL,
+                        stderr=log_file,
+                        env={**os.environ, "BLENDER_MCP_SOCKET": path},
+                        start_new_session=True
+                    )
+            elif daemon.poll() is not None:
+                raise RuntimeError(f"Blender daemon exited (see {path}.log)")
+
+            if time.monotonic() > deadline:
+                raise RuntimeError("Timed out waiting for Blender daemon")
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+
+        self._attach(sock)
+
+    def _attach(self, sock):
+        # Every recv() under the buffered reader is bounded, so a hung daemon can't block us forever
+        sock.settimeout(MCP_TIMEOUT or None)
+        self.sock = sock
+        self.reader = sock.makefile("rb", buffering=PIPE_BUFFER_SIZE)
+        self.writer = sock.makefile("wb", buffering=PIPE_BUFFER_SIZE)
+
+    def stop_daemon(self):
+        """Asks a running Blender daemon to exit. Returns False if none is listening."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(daemon_socket_path())
+        except (ConnectionRefusedError, FileNotFoundError):
+            sock.close()
+            return False
+        self._attach(sock)
+        try:
+            self._send_request("shutdown")
+            self._waiting_response()
+        except DaemonBusyError:
+            raise
+        except (OSError, RuntimeError):
+            # Accepted just as another shutdown closed the daemon
+            return False
+        finally:
+            self.close()
+        return True
+
+    def _write_message(self, msg):
+        body = json_dumps(msg)
+        # Header and body go out in a single write()
+        self.writer.write(f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body)
+        self.writer.flush()
+
+    def _read_message(self):
+        try:
+            return self._read_frame()
+        except TimeoutError:
+            # The stream may hold a partial frame now; this connection can't be reused
+            raise MCPTimeoutError(f"MCP server unresponsive (no reply in {MCP_TIMEOUT:g}s)") from None
+
+    def _closed_error(self):
+        if self.process and self.process.poll() is not None:
+            return RuntimeError(f"Blender server exited with code {self.process.returncode}")
+        return RuntimeError("Server closed connection")
+
+    def _read_frame(self):
+        length = None
+        while True:
+            line = self.reader.readline()
+            if not line:
+                raise self._closed_error()
+            line = line.strip()
+            if not line:
+                if length is not None:
+                    break # End of headers
+                continue
+            # Blender prints its own banner to stdout; anything that isn't our header is skipped
+            name, sep, value = line.partition(b":")
+            if sep and name.strip().lower() == b"content-length":
+                length = int(value)
+
+        body = self.reader.read(length)
+        if len(body) < length:
+            raise self._closed_error()
+        msg = json_loads(body)
+        # An error without an id answers no request: the server is refusing the whole connection
+        if isinstance(msg, dict) and msg.get("id") is None and "error" in msg:
+            error = msg["error"]
+            if error.get("code") == DAEMON_BUSY:
+                raise DaemonBusyError(error.get("message"))
+            raise RuntimeError(f"MCP server error: {error.get('message')}")
+        return msg
 
     def _send_request(self, method, params=None):
         self.request_id += 1
@@ -58,9 +228,7 @@ class BlenderMCPClient:
             "method": method,
             "params": params or {}
         }
-        json_line = json.dumps(req)
-        self.process.stdin.write(json_line + "\n")
-        self.process.stdin.flush()
+        self._write_message(req)
         return self.request_id
 
     def _send_notification(self, method, params=None):
@@ -69,40 +237,118 @@ class BlenderMCPClient:
             "method": method,
             "params": params or {}
         }
-        json_line = json.dumps(req)
-        self.process.stdin.write(json_line + "\n")
-        self.process.stdin.flush()
+        self._write_message(req)
 
     def _waiting_response(self):
         while True:
-            line = self.process.stdout.readline()
-            if not line:
-                raise RuntimeError("Server closed connection")
+            msg = self._read_message()
+            if "id" in msg and msg["id"] == self.request_id:
+                return msg
+
+    def _exchange(self, send_and_wait):
+        """
+        Runs send_and_wait() under the lock. Returns (result, None), or (None, error text) when the
+        daemon timed out or refused us; the connection is then dropped and reopened on the next call.
+        """
+        with self.lock:
             try:
-                msg = json.loads(line)
-                if "id" in msg and msg["id"] == self.request_id:
-                    return msg
-            except json.JSONDecodeError:
-                continue
+                if self.reader is None:
+                    self._connect_daemon()
+                    self._initialize()
+                return send_and_wait(), None
+            except MCPTimeoutError as e:
+                self.close()
+                return None, f"Error: {e}. The call may still finish in Blender; the next call reconnects."
+            except DaemonBusyError as e:
+                self.close()
+                return None, f"Error: {e}. An earlier timed-out call is probably still running; try again later."
 
     def call_tool(self, name, arguments):
-        self._send_request("tools/call", {
-            "name": name,
-            "arguments": arguments
-        })
-        resp = self._waiting_response()
-        
+        def send_and_wait():
+            self._send_request("tools/call", {
+                "name": name,
+                "arguments": arguments
+            })
+            return self._waiting_response()
+
+        resp, error = self._exchange(send_and_wait)
+        return error or self._tool_text(resp)
+
+    def call_tools_batch(self, calls):
+        """
+        Sends [(name, arguments), ...] as one JSON-RPC batch, so the calls cost a single
+        round trip. The server runs them in order; results come back in call order.
+        """
+        if not calls:
+            return []
+
+        def send_and_wait():
+            batch = []
+            for name, arguments in calls:
+                self.request_id += 1
+                batch.append({
+                    "jsonrpc": "2.0",
+                    "id": self.request_id,
+                    "method": "tools/call",
+                    "params": {"name": name, "arguments": arguments}
+                })
+            self._write_message(batch)
+
+            pending = {req["id"] for req in batch}
+            responses = {}
+            while pending:
+                msg = self._read_message()
+                for resp in msg if isinstance(msg, list) else [msg]:
+                    if resp.get("id") in pending:
+                        pending.discard(resp["id"])
+                        responses[resp["id"]] = resp
+            return [responses[req["id"]] for req in batch]
+
+        resps, error = self._exchange(send_and_wait)
+        if error:
+            return [error] * len(calls)
+        return [self._tool_text(resp) for resp in resps]
+
+    @staticmethod
+    def _tool_text(resp):
         if "error" in resp:
             return f"Error: {resp['error']['message']}"
         
         # Parse result
-        content = resp.get("result", {}).get("content", [])
-        text_res = [c["text"] for c in content if c["type"] == "text"]
-        return "\n".join(text_res)
+        result = resp.get("result", {})
+        content = result.get("content", [])
+        text = "\n".join(c["text"] for c in content if c["type"] == "text")
+        # Every failure reads "Error...", so callers can tell (see is_error)
+        if result.get("isError") and not text.startswith("Error"):
+            text = f"Error: {text}"
+        return text
+
+    async def acall_tool(self, name, arguments):
+        # Run the blocking pipe exchange off the event loop
+        async with self.async_lock:
+            return await asyncio.to_thread(self.call_tool, name, arguments)
+
+    async def acall_tools_batch(self, calls):
+        async with self.async_lock:
+            return await asyncio.to_thread(self.call_tools_batch, calls)
 
     def close(self):
-        if self.process:
-            self.process.terminate()
+        if self.sock:
+            # Leave the daemon running for the next session
+            self.reader.close()
+            self.writer.close()
+            self.sock.close()
+            self.sock = self.reader = self.writer = None
+        elif self.process:
+            # EOF on stdin makes serve() write queued blend saves and return; terminate only if it doesn't
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            try:
+                self.process.wait(timeout=SERVER_EXIT_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.process.terminate()
 
 # Define tools
 tools_def = [
@@ -148,101 +394,303 @@ tools_def = [
     }
 ]
 
+# Provider-specific variant, shaped once at import; a tuple so it can't be appended to by accident
+# (types.MappingProxyType is not JSON-serializable, so the OpenAI SDK would reject frozen dicts)
+TOOLS_OPENAI = tuple(LLMClient.to_openai_tool(t) for t in tools_def)
+# Serialized once for prompts that embed the schemas; the hash identifies this tool set in the LLM cache
+_TOOLS_DEF_JSON = json_dumps(tools_def)
+_TOOLS_DEF_HASH = hashlib.blake2b(_TOOLS_DEF_JSON, digest_size=8).hexdigest()
+
 class Spinner:
+    """
+    One status line animated by a single long-lived task on the event loop.
+    Phases swap the text with set_message() and toggle it with resume()/pause().
+    """
     def __init__(self, message="Thinking..."):
         self.message = message
-        self.stop_event = threading.Event()
-        self.thread = threading.Thread(target=self._spin)
+        self.active = None # asyncio.Event, created on the running loop
+        self.task = None
+        self.width = 0 # Columns currently drawn
 
-    def start(self):
-        self.stop_event.clear()
-        if not self.thread.is_alive():
-            self.thread = threading.Thread(target=self._spin)
-            self.thread.start()
+    def set_message(self, message):
+        self.message = message
 
-    def stop(self):
-        self.stop_event.set()
-        if self.thread.is_alive():
-            self.thread.join()
+    def resume(self):
+        if self.task is None or self.task.done():
+            self.active = asyncio.Event()
+            self.task = asyncio.create_task(self._spin())
+        self.active.set()
 
-    def _spin(self):
+    def pause(self):
+        # Synchronous: the task only draws after active.wait(), so nothing is drawn past this point
+        if self.active is not None and self.active.is_set():
+            self.active.clear()
+            sys.stdout.write("\r" + " " * self.width + "\r")
+            sys.stdout.flush()
+            self.width = 0
+
+    async def _spin(self):
         ws = itertools.cycle(["|", "/", "-", "\\"])
-        while not self.stop_event.is_set():
-            sys.stdout.write(f"\r{self.message} {next(ws)}")
+        message = None
+        while True:
+            await self.active.wait()
+            if self.message != message:
+                # Rebuilt only when the text changes, not on every tick
+                message = self.message
+                prefix = f"\r{message} "
+                # Pad over the tail of a longer previous message
+                pad = " " * (self.width - len(message) - 2)
+                frame_width = len(message) + 2 + len(pad)
+            sys.stdout.write(prefix + next(ws) + pad)
             sys.stdout.flush()
-            time.sleep(0.1)
-        sys.stdout.write("\r" + " " * (len(self.message) + 2) + "\r")
+            self.width = frame_width
+            await asyncio.sleep(0.1)
+
+# Shared by every phase of every turn
+spinner = Spinner()
+
+def ainput(prompt):
+    """input() that doesn't block the event loop. Returns a future for the line."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(setter, value):
+        if not future.done():
+            setter(value)
+
+    def read():
+        try:
+            line = input(prompt)
+        except Exception as e: # e.g. EOFError
+            loop.call_soon_threadsafe(settle, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(settle, future.set_result, line)
+
+    # A daemon thread (not the default executor) so Ctrl+C doesn't wait for a pending input()
+    threading.Thread(target=read, daemon=True).start()
+    return future
+
+def write_lines(lines):
+    """Writes a block of lines with one write and one flush (print() pays for both per line)."""
+    sys.stdout.write("".join(f"{line}\n" for line in lines))
+    sys.stdout.flush()
+
+def is_error(result):
+    """True for a tool result reporting failure (tool isError, JSON-RPC error or a lost connection)."""
+    return result.startswith("Error")
+
+class ToolQueue:
+    """
+    Runs streamed tool calls in arrival order. The first call starts at once; calls that
+    arrive while a batch is running in Blender go out together as the next JSON-RPC batch.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.queued = [] # [(function_call, future)] not yet sent
+        self.pump = None
+
+    def submit(self, fc):
+        """Queues fc and returns a future for its result text."""
+        future = asyncio.get_running_loop().create_future()
+        self.queued.append((fc, future))
+        if self.pump is None or self.pump.done():
+            self.pump = asyncio.create_task(self._pump())
+        return future
+
+    async def _pump(self):
+        while self.queued:
+            batch, self.queued = self.queued, []
+            try:
+                results = await self.client.acall_tools_batch([(fc["name"], fc["args"]) for fc, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+class StreamPrinter:
+    """Prints streamed response text as it arrives, prefixed once with 'Agent: '."""
+    def __init__(self):
+        self.started = False
+
+    def __call__(self, text):
+        if not self.started:
+            sys.stdout.write("Agent: ")
+            self.started = True
+        sys.stdout.write(text)
         sys.stdout.flush()
 
-def main():
+    def end(self):
+        if self.started:
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+
+async def generate_batch(client, llm, prompts):
+    """Generates one material per prompt, packing up to LLMClient.BATCH_LIMIT prompts per LLM request."""
+    chunks = [prompts[i:i + llm.BATCH_LIMIT] for i in range(0, len(prompts), llm.BATCH_LIMIT)]
+
+    spinner.set_message(f"Agent is planning {len(prompts)} materials...")
+    spinner.resume()
+    try:
+        batches = await asyncio.gather(*[llm.asend_batch(chunk) for chunk in chunks])
+    finally:
+        spinner.pause()
+
+    func_calls = [fc for batch in batches for fc in batch]
+    if len(func_calls) != len(prompts):
+        print(f"Warning: got {len(func_calls)} tool calls for {len(prompts)} prompts.")
+    if not func_calls:
+        return
+
+    spinner.set_message(f"Running {len(func_calls)} tools...")
+    spinner.resume()
+    try:
+        results = await client.acall_tools_batch([(fc["name"], fc["args"]) for fc in func_calls])
+    finally:
+        spinner.pause()
+
+    write_lines(f"Tool Output ({fc['name']}): {result}" for fc, result in zip(func_calls, results))
+
+async def run_turn(client, llm, user_input):
+    """
+    Runs one user turn through the LLM/tool loop.
+    Returns (final_text, executed [(name, args), ...], succeeded) where succeeded is
+    False if the loop limit cut the turn short or any tool call failed.
+    """
+    # Tool calls start running in Blender as soon as the stream delivers them, in stream order
+    tools = ToolQueue(client)
+    tool_results = []
+    def dispatch(fc):
+        tool_results.append(tools.submit(fc))
+
+    printer = StreamPrinter()
+    try:
+        response_text, func_calls = await llm.asend_message(user_input, on_text=printer, on_tool_call=dispatch)
+    finally:
+        printer.end()
+
+    executed = []
+    failed = False
+
+    # Limit loop count to prevent infinite loops
+    loop_count = 0
+    MAX_LOOPS = 10
+    
+    while func_calls and loop_count < MAX_LOOPS:
+        loop_count += 1
+        names = ", ".join(fc["name"] for fc in func_calls)
+        
+        print(f"Agent calling tool: {names}(...)({loop_count}/{MAX_LOOPS})")
+        
+        # Wait for this round's calls; dispatch already queued every one of them
+        spinner.set_message(f"Running tool {names}...")
+        spinner.resume()
+        try:
+            results = await asyncio.gather(*tool_results)
+        finally:
+            spinner.pause()
+        tool_results = []
+        executed.extend((fc["name"], fc["args"]) for fc in func_calls)
+        failed = failed or any(is_error(result) for result in results)
+            
+        write_lines(f"Tool Output: {result}" for result in results)
+        
+        # Feed results back to LLM; don't start tools for a round the loop limit will skip
+        printer = StreamPrinter()
+        try:
+            response_text, func_calls = await llm.asend_tool_result(
+                list(zip(func_calls, results)),
+                on_text=printer,
+                on_tool_call=dispatch if loop_count < MAX_LOOPS else None
+            )
+        finally:
+            printer.end()
+    
+    if loop_count >= MAX_LOOPS:
+        print("Warning: Maximum tool loop limit reached.")
+        return response_text, executed, False
+    return response_text, executed, not failed
+
+async def replay_turn(client, llm, user_input, cached):
+    """Re-runs a cached turn's tool calls in their original order, without the LLM."""
+    calls = [(name, args) for name, args in cached["calls"]]
+    names = ", ".join(name for name, _ in calls)
+    print(f"Agent calling tool (cached): {names}(...)")
+    spinner.set_message(f"Running tool {names}...")
+    spinner.resume()
+    try:
+        # One batch; the server still runs them in their original order
+        results = await client.acall_tools_batch(calls)
+    finally:
+        spinner.pause()
+    write_lines(f"Tool Output: {result}" for result in results)
+
+    if cached["text"]:
+        print(f"Agent: {cached['text']}")
+    # Keep the model's view of the conversation in step with what the user saw
+    llm.record_turn(user_input, cached["text"])
+
+async def main():
     client = BlenderMCPClient(BLENDER_PATH)
+    if "--kill" in sys.argv[1:]:
+        if not hasattr(socket, "AF_UNIX"):
+            print("No Blender daemon on this platform.")
+        else:
+            try:
+                if client.stop_daemon():
+                    print("Blender daemon stopped.")
+                else:
+                    print("No Blender daemon running.")
+            except DaemonBusyError as e:
+                print(f"Error: {e}; close that session first.")
+        return
+
+    turn_cache = TurnCache() if TURN_CACHE else None
     try:
         client.start()
         
         print(f"Initializing LLM Provider: {LLM_PROVIDER}")
-        llm = LLMClient(provider=LLM_PROVIDER, tools=tools_def)
+        llm = LLMClient(
+            provider=LLM_PROVIDER, tools=tools_def, openai_tools=TOOLS_OPENAI,
+            tools_json=_TOOLS_DEF_JSON, tools_hash=_TOOLS_DEF_HASH
+        )
         
         print(f"\nAgent is ready! (LLM Model: {llm.model_name})")
         print("Example: 'Create a shiny red metallic material'")
+        print("Batch: '/batch gold | rusty iron | oak wood' creates one material per prompt")
         print("Type 'quit' to exit")
         
         while True:
-            user_input = input("\nYou('quit' to exit): ")
+            # Background tasks (history summarization) keep running while the user types
+            user_input = await ainput("\nYou('quit' to exit): ")
             if user_input.lower() in ["quit", "exit"]:
                 break
-                
-            spinner = Spinner("Agent is thinking...")
-            spinner.start()
-            try:
-                response_text, func_call = llm.send_message(user_input)
-            finally:
-                spinner.stop()
-            
-            # Print initial thought if any
-            if response_text:
-                print(f"Agent: {response_text}")
-
-            # Limit loop count to prevent infinite loops
-            loop_count = 0
-            MAX_LOOPS = 10
             
-            while func_call and loop_count < MAX_LOOPS:
-                loop_count += 1
-                fname = func_call["name"]
-                fargs = func_call["args"]
-                call_id = func_call.get("id")
-                
-                print(f"Agent calling tool: {fname}(...)({loop_count}/{MAX_LOOPS})")
-                
-                # Execute tool via MCP
-                spinner_tool = Spinner(f"Running tool {fname}...")
-                spinner_tool.start()
-                try:
-                    result = client.call_tool(fname, fargs)
-                finally:
-                    spinner_tool.stop()
-                    
-                print(f"Tool Output: {result}")
-                
-                # Feed result back to LLM
-                spinner_res = Spinner("Analyzing result...")
-                spinner_res.start()
-                try:
-                    # Reformatted to receive tuple (text, func_call)
-                    response_text, func_call = llm.send_tool_result(fname, result, tool_call_id=call_id)
-                finally:
-                    spinner_res.stop()
+            if user_input.startswith("/batch "):
+                prompts = [p.strip() for p in user_input[len("/batch "):].split("|") if p.strip()]
+                await generate_batch(client, llm, prompts)
+                continue
                 
-                if response_text:
-                    print(f"Agent: {response_text}")
-            
-            if loop_count >= MAX_LOOPS:
-                print("Warning: Maximum tool loop limit reached.")
+            # Conversation before this turn; prompts like "save it" only replay in the same context
+            context = llm.history_hash() if turn_cache else None
+            cached = turn_cache.get(user_input, context) if turn_cache else None
+            if cached:
+                await replay_turn(client, llm, user_input, cached)
+                continue
+
+            final_text, executed, succeeded = await run_turn(client, llm, user_input)
+            # Failed turns aren't stored, so a repeat of the prompt gives the LLM another try
+            if turn_cache and succeeded and executed:
+                turn_cache.put(user_input, context, executed, final_text)
             
     except Exception as e:
         print(f"\nError: {e}")
     finally:
         client.close()
+        await close_http_client()
+        if turn_cache:
+            turn_cache.save()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())